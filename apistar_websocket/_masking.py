@@ -0,0 +1,38 @@
+"""
+WebSocket payload masking, picks the fastest implementation available.
+The C speedups extension, then NumPy, then pure Python.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _py_apply_mask(data: bytes, mask: bytes) -> bytes:
+    """
+    Apply a 4 byte mask to the data, masking and unmasking are the same operation.
+    """
+    if len(mask) != 4:
+        raise ValueError('mask must contain 4 bytes')
+
+    return bytes(b ^ mask[i & 3] for i, b in enumerate(data))
+
+
+def apply_mask_np(data: bytes, mask: bytes) -> bytes:
+    """
+    Vectorized version of _py_apply_mask using NumPy.
+    """
+    if len(mask) != 4:
+        raise ValueError('mask must contain 4 bytes')
+
+    payload = np.frombuffer(data, np.uint8)
+    tiled_mask = np.resize(np.frombuffer(mask, np.uint8), payload.size)
+
+    return (payload ^ tiled_mask).tobytes()
+
+
+try:
+    from .speedups import apply_mask
+except ImportError:
+    apply_mask = _py_apply_mask if np is None else apply_mask_np
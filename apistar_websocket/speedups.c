@@ -0,0 +1,105 @@
+/* C implementation of the WebSocket payload masking in websocket.py */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+
+/* The AVX2 loop is compiled for x86 with GCC or Clang and only used when the CPU running
+ * the code supports it, so builds don't depend on the build host's instruction set. */
+#if (defined(__GNUC__) || defined(__clang__)) && (defined(__x86_64__) || defined(__i386__))
+#define APPLY_MASK_AVX2
+#include <immintrin.h>
+#endif
+
+static const Py_ssize_t MASK_LEN = 4;
+
+#ifdef APPLY_MASK_AVX2
+/* XOR 32 bytes at a time with the 4 byte mask broadcast over a 256 bit register,
+ * returns how many bytes were masked. */
+__attribute__((target("avx2")))
+static Py_ssize_t
+apply_mask_avx2(const char *input, char *output, Py_ssize_t input_len, const char *mask)
+{
+    Py_ssize_t input_len_256 = input_len & ~31;
+    Py_ssize_t i = 0;
+    uint32_t mask_32;
+    __m256i mask_256, in_256, out_256;
+
+    memcpy(&mask_32, mask, MASK_LEN);
+    mask_256 = _mm256_set1_epi32((int)mask_32);
+
+    for (; i < input_len_256; i += 32) {
+        in_256 = _mm256_loadu_si256((const __m256i *)(input + i));
+        out_256 = _mm256_xor_si256(in_256, mask_256);
+        _mm256_storeu_si256((__m256i *)(output + i), out_256);
+    }
+
+    return i;
+}
+#endif
+
+static PyObject *
+apply_mask(PyObject *self, PyObject *args)
+{
+    const char *input;
+    Py_ssize_t input_len;
+    const char *mask;
+    Py_ssize_t mask_len;
+    PyObject *result;
+    char *output;
+    Py_ssize_t i = 0;
+
+    if (!PyArg_ParseTuple(args, "y#y#", &input, &input_len, &mask, &mask_len)) {
+        return NULL;
+    }
+
+    if (mask_len != MASK_LEN) {
+        PyErr_SetString(PyExc_ValueError, "mask must contain 4 bytes");
+        return NULL;
+    }
+
+    result = PyBytes_FromStringAndSize(NULL, input_len);
+    if (result == NULL) {
+        return NULL;
+    }
+
+    output = PyBytes_AS_STRING(result);
+
+#ifdef APPLY_MASK_AVX2
+    if (__builtin_cpu_supports("avx2")) {
+        i = apply_mask_avx2(input, output, input_len, mask);
+    }
+#endif
+
+    /* i is a multiple of 4 here, so the mask stays aligned with the payload */
+    for (; i < input_len; i++) {
+        output[i] = input[i] ^ mask[i & (MASK_LEN - 1)];
+    }
+
+    return result;
+}
+
+static PyMethodDef speedups_methods[] = {
+    {
+        "apply_mask",
+        (PyCFunction)apply_mask,
+        METH_VARARGS,
+        "Apply a 4 byte mask to the data, masking and unmasking are the same operation.",
+    },
+    {NULL, NULL, 0, NULL},
+};
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    "apistar_websocket.speedups",
+    "C implementation of the WebSocket payload masking",
+    -1,
+    speedups_methods,
+};
+
+PyMODINIT_FUNC
+PyInit_speedups(void)
+{
+    return PyModule_Create(&speedups_module);
+}
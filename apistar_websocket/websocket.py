@@ -1,17 +1,76 @@
+import asyncio
 import logging
 import typing
-from enum import Enum
+import weakref
+from enum import IntEnum
+from operator import attrgetter
 
-import websockets
 from apistar import App
 from apistar.exceptions import HTTPException
 from apistar.http import Response
 from apistar.server.asgi import ASGIReceive, ASGIScope, ASGISend
 from apistar.server.components import Component
 
+from ._masking import apply_mask
+
 logger = logging.getLogger(__name__)
 
-class Status(Enum):
+# Maps a payload type to the ASGI message key it's sent under
+_TYPE_KEY = {str: 'text', bytes: 'bytes'}
+
+
+def _payload_key(data) -> str:
+    """
+    The ASGI message key for a payload, with an exact type lookup for the common case
+    and an isinstance check for str and bytes subclasses.
+    """
+    key = _TYPE_KEY.get(type(data))
+    if key is not None:
+        return key
+
+    if isinstance(data, str):
+        return 'text'
+
+    if isinstance(data, bytes):
+        return 'bytes'
+
+    if isinstance(data, memoryview):
+        raise TypeError('Use WebSocket.send_view() to send a memoryview')
+
+    raise TypeError('WebSocket payload must be str or bytes, not %s' % type(data).__name__)
+
+
+# Message templates, the accept message is sent as is and must never be mutated.
+_ACCEPT_MSG = {'type': 'websocket.accept'}
+_SEND_TEMPLATE = {'type': 'websocket.send'}
+
+# Where WebSocketComponent keeps a weakref to the WebSocket it resolved for a request
+_SCOPE_KEY = 'apistar_websocket.websocket'
+
+_fast_loop_installed = False
+
+
+def install_fast_loop() -> bool:
+    """
+    Opt in to uvloop as the default event loop policy, if it's available.
+    Returns True when uvloop is in use. Nothing in apistar-websocket calls this,
+    running under `uvicorn --loop uvloop` is the preferred way to get uvloop.
+    """
+    global _fast_loop_installed
+
+    if not _fast_loop_installed:
+        try:
+            import uvloop
+        except ImportError:
+            return False
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        _fast_loop_installed = True
+
+    return True
+
+
+class Status(IntEnum):
     # 1000 indicates a normal closure, meaning that the purpose for
     # which the connection was established has been fulfilled.
     OK = 1000
@@ -71,10 +130,16 @@ class Status(Enum):
     TLS_FAIL = 1010
 
 
+# Close messages for each status code, copied so they're never mutated
+_CLOSE_TEMPLATES = {
+    s.value: {'type': 'websocket.disconnect', 'code': s.value} for s in Status
+}
+
+
 class WebSocketClosed(HTTPException):
     def __init__(self,
                  detail: str = 'WebSocket has closed',
-                 status_code: int = Status.OK.value) -> None:
+                 status_code: int = Status.OK) -> None:
         super().__init__(detail, 200)
 
         #  def get_headers(self):
@@ -85,7 +150,7 @@ class WebSocketClosed(HTTPException):
 class WebSocketProtocolError(HTTPException):
     def __init__(self,
                  detail: str = 'WebSocket protocol error',
-                 status_code: int = Status.PROT_ERROR.value) -> None:
+                 status_code: int = Status.PROT_ERROR) -> None:
         super().__init__(detail, status_code)
 
 
@@ -107,53 +172,104 @@ class WebSocket(object):
 
         # Process HTTP Response
     """
+    __slots__ = (
+        'scope', 'asgi_send', 'asgi_receive', '_ws_request', 'is_websocket', '_state_getter',
+        'send_memoryview', '__weakref__',
+    )
+
+    # websockets is only needed for is_open, so it's imported the first time it's used
+    _OPEN_STATE = None
+
     def __init__(self,
                  asgi_scope: dict,
                  asgi_send: typing.Callable,
                  asgi_receive: typing.Callable,
+                 send_memoryview: bool = False,
                  ) -> None:
 
         self.scope = asgi_scope
         self.asgi_send = asgi_send
         self.asgi_receive = asgi_receive
+        self.is_websocket = asgi_scope.get('type') == 'websocket'
+
+        # ASGI says binary payloads are bytes, only set this when the server is known
+        # to take a memoryview as well so send_view() can skip the copy.
+        self.send_memoryview = send_memoryview
 
         # UVicorn specific, get the WebSocketRequest instance
         # This will blow up under the debug server, so we'll fake it, I guess?
-        try:
-            self._ws_request = asgi_send.__self__
-        except AttributeError as e:
+        self._ws_request = getattr(asgi_send, '__self__', None)
+        if self._ws_request is None:
             logger.error("Unable to get a reference to underlying Uvicorn websocket instance")
-            self._ws_request = None
 
-    @property
-    def state(self):
+        self._resolve_state()
+
+    def _resolve_state(self):
+        # Newer Uvicorn versions keep the state on the request itself, older
+        # ones on the protocol. Work out which once instead of on every access.
         if hasattr(self._ws_request, 'state'):
-            return self._ws_request.state
+            self._state_getter = attrgetter('state')
+        else:
+            self._state_getter = attrgetter('protocol.state')
 
-        return self._ws_request.protocol.state
+    @property
+    def state(self):
+        return self._state_getter(self._ws_request)
 
     @property
     def is_open(self):
-        return self.state is websockets.protocol.State.OPEN
+        if WebSocket._OPEN_STATE is None:
+            import websockets
+            WebSocket._OPEN_STATE = websockets.protocol.State.OPEN
 
-    async def send(self, data=None, **kwargs):
-        msg = {
-            'type': 'websocket.send',
-        }
+        return self.state is WebSocket._OPEN_STATE
 
-        msg.update(kwargs)
+    async def send(self, data=None, mask=None, **kwargs):
+        msg = _SEND_TEMPLATE.copy()
 
-        if data:
-            if isinstance(data, str):
-                msg['text'] = data
-            elif isinstance(data, bytes):
-                msg['bytes'] = data
+        if kwargs:
+            msg.update(kwargs)
+
+        if data is not None:
+            key = _payload_key(data)
+            if mask is not None:
+                if key != 'bytes':
+                    raise TypeError('Only bytes payloads can be masked')
+                data = apply_mask(data, mask)
+            msg[key] = data
+
+        return await self.asgi_send(msg)
+
+    async def send_view(self, view: memoryview, **kwargs):
+        """
+        Send a binary message from a memoryview, it's only copied to bytes when
+        the server can't take the memoryview as is.
+        """
+        msg = _SEND_TEMPLATE.copy()
+
+        if kwargs:
+            msg.update(kwargs)
+
+        msg['bytes'] = view if self.send_memoryview else bytes(view)
 
         return await self.asgi_send(msg)
 
+    async def send_many(self, items: typing.Iterable):
+        """
+        Send each item as its own message, in order. Items are typed the same way as
+        in send(), anything other than str or bytes raises a TypeError.
+        Messages are sent one after another rather than gathered, so they can't be
+        reordered on the wire.
+        """
+        asgi_send = self.asgi_send
+
+        for data in items:
+            await asgi_send({'type': 'websocket.send', _payload_key(data): data})
+
     async def receive(self):
         msg = await self.asgi_receive()
-        return msg.get('text', msg.get('bytes'))
+        text = msg.get('text')
+        return text if text is not None else msg.get('bytes')
 
     async def connect(self):
         # Try to accept and upgrade the websocket
@@ -163,19 +279,14 @@ class WebSocket(object):
             raise WebSocketProtocolError(
                 'Expected websocket connection but got: %s' % msg['type'])
 
-        await self.asgi_send({'type': 'websocket.accept'})
+        await self.asgi_send(_ACCEPT_MSG)
 
-    async def close(self, code: int = Status.OK.value, data=None):
-        message = {
-            'type': 'websocket.disconnect',
-            'code': code,
-        }
+    async def close(self, code: int = Status.OK, data=None):
+        base = _CLOSE_TEMPLATES.get(code)
+        message = base.copy() if base else {'type': 'websocket.disconnect', 'code': code}
 
-        if data:
-            if isinstance(data, str):
-                message['text'] = data
-            elif isinstance(data, bytes):
-                message['bytes'] = data
+        if data is not None:
+            message[_payload_key(data)] = data
 
         await self.asgi_send(message)
 
@@ -186,32 +297,50 @@ class WebSocketAutoHook():
     Automatically close the websocket after it's handled
     NOTE: This hook only works if AsyncApp::asgi_finalize supports the webhook type
     and doesn't send HTTP Response data when a WebSocket is finished.
+
+    The hooks must stay coroutine functions. APIStar's injector decides whether to await
+    a hook with asyncio.iscoroutinefunction, so a plain function returning a coroutine
+    would never be awaited and the WebSocket would never connect or close.
     """
     async def on_request(self, ws: WebSocket):
-        if ws.scope.get('type') == 'websocket':
+        if ws.is_websocket:
             await ws.connect()
 
     async def on_response(self, ws: WebSocket, response: Response, scope: ASGIScope):
-        if ws.scope.get('type') == 'websocket':
+        if ws.is_websocket:
             if ws.is_open:
                 scope['raise_exceptions'] = True
-                await ws.close(data=response.content if response else None)
+                content = response.content if response is not None else None
+                await ws.close(data=content or None)
 
             # Go for the inner exception by always raising for websocket
             raise WebSocketClosed()
 
     async def on_error(self, ws: WebSocket, response: Response):
-        if ws.scope.get('type') == 'websocket':
+        if ws.is_websocket:
             if ws.is_open:
-                await ws.close(data=response.content if response else None)
+                content = response.content if response is not None else None
+                await ws.close(data=content or None)
                 raise WebSocketClosed()
 
 
 class WebSocketComponent(Component):
+    def __init__(self, send_memoryview: bool = False) -> None:
+        self.send_memoryview = send_memoryview
+
     def resolve(self,
                 scope: ASGIScope,
                 send: ASGISend,
                 receive: ASGIReceive) -> WebSocket:
 
-        return WebSocket(scope, send, receive)
+        # Reuse the instance for every injection point of the same request, the injector
+        # keeps it alive for the request. The scope only holds a weak reference so it
+        # doesn't form a scope -> ws -> scope cycle.
+        ws_ref = scope.get(_SCOPE_KEY)
+        ws = ws_ref() if ws_ref is not None else None
+        if ws is None:
+            ws = WebSocket(scope, send, receive, self.send_memoryview)
+            scope[_SCOPE_KEY] = weakref.ref(ws)
+
+        return ws
 
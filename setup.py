@@ -4,7 +4,7 @@
 import os
 import re
 
-from setuptools import setup
+from setuptools import Extension, setup
 
 
 def get_version(package):
@@ -25,6 +25,20 @@ def get_long_description(long_description_file):
     return long_description
 
 
+def get_ext_modules():
+    """
+    The optional masking speedups, the pure Python fallback is used when they can't
+    be built.
+    """
+    return [
+        Extension(
+            'apistar_websocket.speedups',
+            sources=['apistar_websocket/speedups.c'],
+            optional=True,
+        ),
+    ]
+
+
 version = get_version('apistar_websocket')
 
 
@@ -37,11 +51,14 @@ setup(
     long_description=get_long_description('README.md'),
     long_description_content_type='text/markdown',
     packages=['apistar_websocket'],
+    ext_modules=get_ext_modules(),
     author='Jeff Buttars',
     author_email='jeff@jeffbuttars.com',
+    python_requires='>=3.8',
     install_requires=[
         'apistar',
         'uvicorn',
+        'uvloop; sys_platform != "win32"',
     ],
     classifiers=[
         'Environment :: Web Environment',
@@ -51,7 +68,10 @@ setup(
         'Topic :: Internet :: WWW/HTTP',
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
 )